@@ -0,0 +1,3 @@
+screen19 now accepts an existing experiment list in the older ``.json`` format, as well as ``.expt``, without importing the images again::
+
+    screen19 imported_experiments.json
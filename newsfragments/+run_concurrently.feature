@@ -0,0 +1,4 @@
+Steps that only read files already written by screen19, such as creating the DIALS report, now run alongside later steps.
+To run every step in turn, for example to limit peak memory usage, use::
+
+    screen19 run_concurrently=False <other arguments>
@@ -24,6 +24,9 @@ debug, info, warn = logger.debug, logger.info, logger.warning
 # Set axis tick positions manually.  Accounts for reciprocal(-square) d-scaling.
 d_ticks = [5, 3, 2, 1.5, 1, 0.9, 0.8, 0.7, 0.6, 0.5, 0.4]
 
+# The group of numerals that xia2-style filename templates replace with hashes.
+_image_number_pattern = re.compile(r"([0-9#]+)(?=\.\w)")
+
 
 def terminal_size(procrunner_debug=False):
     """
@@ -36,16 +39,25 @@ def terminal_size(procrunner_debug=False):
     columns, rows = 80, 25
     if sys.stdout.isatty():
         try:
-            result = procrunner.run(
-                ["stty", "size"],
-                timeout=1,
-                print_stdout=False,
-                print_stderr=False,
-                debug=procrunner_debug,
-            )
-            rows, columns = [int(i) for i in result["stdout"].decode("utf-8").split()]
-        except Exception:  # ignore any errors and use default size
-            pass  # FIXME: Can we be more specific about the type of exception?
+            # Query the terminal directly, rather than starting a process.
+            columns, rows = os.get_terminal_size(sys.stdout.fileno())
+        except AttributeError:
+            # Python 2 has no os.get_terminal_size, so fall back to stty.
+            try:
+                result = procrunner.run(
+                    ["stty", "size"],
+                    timeout=1,
+                    print_stdout=False,
+                    print_stderr=False,
+                    debug=procrunner_debug,
+                )
+                rows, columns = [
+                    int(i) for i in result["stdout"].decode("utf-8").split()
+                ]
+            except Exception:  # ignore any errors and use default size
+                pass  # FIXME: Can we be more specific about the type of exception?
+        except (OSError, ValueError):  # ignore any errors and use default size
+            pass
     columns = min(columns, 120)
     rows = min(rows, int(columns / 3))
 
@@ -73,6 +85,20 @@ def prettyprint_dictionary(d):
     )
 
 
+def debug_result(result):
+    """
+    Log the result of running a subprocess, if debug logging is enabled.
+
+    The result is only formatted if it will be logged, since the captured output of
+    the subprocess may be long.
+
+    :param result: The result of :func:`procrunner.run`.
+    :type result: Dict[str, Any]
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        debug("result = %s", prettyprint_dictionary(result))
+
+
 def make_template(f):
     """
     Generate a xia2-style filename template.
@@ -91,7 +117,7 @@ def make_template(f):
     directory, f = os.path.split(f)
     # Split off the file extension, assuming it begins at the first full stop,
     # also split the last contiguous group of digits off the filename root
-    parts = re.split(r"([0-9#]+)(?=\.\w)", f, 1)
+    parts = _image_number_pattern.split(f, 1)
     # Get the number of digits in the group we just isolated and their value
     try:
         # Combine the root, a hash for each digit and the extension
@@ -160,11 +186,12 @@ def plot_intensities(
         info(traceback.format_exc())
         result = {}
 
-    debug("result = %s", prettyprint_dictionary(result))
+    debug_result(result)
 
     if result["exitcode"] == 0:
         star = re.compile(r"\*")
         state = set()
+        plot = []
         for line in result["stdout"].decode("utf-8").split("\n"):
             if line.strip() != "":
                 stars = {m.start(0) for m in re.finditer(star, line)}
@@ -175,7 +202,9 @@ def plot_intensities(
                     line = list(line)
                     for s in state:
                         line[s] = "*"
-                info("".join(line))
+                plot.append("".join(line))
+        # Log the whole plot at once, rather than emitting a record for each line.
+        info("\n".join(plot))
     else:
         warn(
             "Error running gnuplot. Cannot plot intensity distribution. "
@@ -42,13 +42,13 @@ import time
 from typing import Iterable, List, Optional, Sequence, Union
 
 import numpy as np
-from scipy.optimize import curve_fit
 from six.moves import cStringIO as StringIO
 from tabulate import tabulate
 
 import iotbx.phil
 from cctbx import miller
 from libtbx.phil import scope, scope_extract
+from libtbx.utils import null_out
 
 from dials.array_family import flex
 from dials.util import log
@@ -141,17 +141,18 @@ def scaled_debye_waller(x, b, a):
 
 
 def wilson_fit(d_star_sq, intensity, sigma, wilson_fit_max_d):
-    # type: (FloatSequence, FloatSequence, FloatSequence, float) -> Fit
+    # type: (np.ndarray, np.ndarray, np.ndarray, float) -> Fit
     u"""
     Fit a simple Debye-Waller factor, assume isotropic disorder parameter.
 
-    Reflections with d ≥ :param:`wilson_fit_max_d` are ignored.
+    Reflections with d ≥ :param:`wilson_fit_max_d`, or with non-finite intensity or
+    uncertainty, are ignored.
 
     Args:
-        d_star_sq: 1/d² (equivalently d*²), sequence of values for the observed
+        d_star_sq: 1/d² (equivalently d*²), NumPy array of values for the observed
             reflections (units of Å⁻² assumed).
-        intensity: Sequence of reflection intensities.
-        sigma: Sequence of uncertainties in reflection intensity.
+        intensity: NumPy array of reflection intensities.
+        sigma: NumPy array of uncertainties in reflection intensity.
         wilson_fit_max_d: The minimum resolution for reflections against which to
             fit.
 
@@ -160,15 +161,21 @@ def wilson_fit(d_star_sq, intensity, sigma, wilson_fit_max_d):
         - The fitted scale factor.
 
     """
-    # Eliminate reflections with d > wilson_fit_max_d from the fit
+    # SciPy's optimisation package is slow to import and only needed here.
+    from scipy.optimize import curve_fit
+
+    # Eliminate reflections with d > wilson_fit_max_d from the fit, along with any
+    # non-finite values, so that SciPy needn't check the data again.
     sel = d_star_sq > 1 / wilson_fit_max_d ** 2
+    sel &= np.isfinite(intensity) & np.isfinite(sigma)
 
     # Perform a weighted Wilson plot fit to the reflection intensities
     fit, cov = curve_fit(
         scaled_debye_waller,
-        d_star_sq.select(sel),
-        intensity.select(sel),
-        sigma=sigma.select(sel),
+        d_star_sq[sel],
+        intensity[sel],
+        sigma=sigma[sel],
+        check_finite=False,
         bounds=(0, np.inf),
     )
 
@@ -244,11 +251,17 @@ def wilson_plot_image(
     plt.xlabel(u"d (Å) (inverse-square scale)")
     plt.ylabel(u"Intensity (counts)")
     if ticks:
-        plt.xticks([1 / d ** 2 for d in ticks], ["%g" % d for d in ticks])
+        plt.xticks(1 / np.square(ticks), ["%g" % d for d in ticks])
     plt.yscale("log", nonposy="clip")
     plt.plot(d_star_sq, intensity, "b.", label=None)
+    # Draw the fitted curve through evenly spaced points, rather than through every
+    # (unsorted) reflection.
+    fit_d_star_sq = np.linspace(np.min(d_star_sq), np.max(d_star_sq), 100)
     plt.plot(
-        d_star_sq, scaled_debye_waller(d_star_sq, *fit), "r-", label="Debye-Waller fit"
+        fit_d_star_sq,
+        scaled_debye_waller(fit_d_star_sq, *fit),
+        "r-",
+        label="Debye-Waller fit",
     )
     if max_d:
         plt.fill_betweenx(
@@ -284,10 +297,9 @@ def suggest_minimum_exposure(expts, refls, params):
         params: Parameters for calculation of minimum exposure estimate.
     """
     # Ignore reflections without an index, since uctbx.unit_cell.d returns spurious
-    # d == -1 values, rather than None, for unindexed reflections.
-    refls.del_selected(refls["id"] == -1)
-    # Ignore all spots flagged as overloaded
-    refls.del_selected(refls.get_flags(refls.flags.overloaded).iselection())
+    # d == -1 values, rather than None, for unindexed reflections.  Also ignore all
+    # spots flagged as overloaded.  Remove both in a single pass.
+    refls.del_selected((refls["id"] == -1) | refls.get_flags(refls.flags.overloaded))
 
     # Work from profile-fitted intensities where possible but if the number of
     # profile-fitted intensities is less than 75% of the number of summed
@@ -315,13 +327,18 @@ def suggest_minimum_exposure(expts, refls, params):
     )
     miller_array.set_observation_type_xray_intensity()
     miller_array = miller_array.merge_equivalents().array()
-    cctbx_log = StringIO()  # Prevent idiosyncratic CCTBX logging from polluting stdout.
+    # Prevent idiosyncratic CCTBX logging from polluting stdout.  Only capture it if
+    # it is going to be written to the debug log.
+    log_french_wilson = logger.isEnabledFor(logging.DEBUG)
+    cctbx_log = StringIO() if log_french_wilson else null_out()
     miller_array = miller_array.french_wilson(log=cctbx_log).as_intensity_array()
-    logger.debug(cctbx_log.getvalue())
+    if log_french_wilson:
+        logger.debug(cctbx_log.getvalue())
 
-    d_star_sq = miller_array.d_star_sq().data()
-    intensity = miller_array.data()
-    sigma = miller_array.sigmas()
+    # Convert to NumPy once, for the fit and the plot.
+    d_star_sq = miller_array.d_star_sq().data().as_numpy_array()
+    intensity = miller_array.data().as_numpy_array()
+    sigma = miller_array.sigmas().as_numpy_array()
 
     # Parameters for the lower-bound exposure estimate:
     min_i_over_sigma = params.minimum_exposure.min_i_over_sigma
@@ -342,12 +359,9 @@ def suggest_minimum_exposure(expts, refls, params):
 
     # Get recommended exposure factors
     # Use the fact that σ² = I for indexed data, so I/σ = √̅I
-    desired_d_star_sq = [1 / d ** 2 for d in desired_d]
+    desired_d_star_sq = 1 / np.square(desired_d)
     target_i = min_i_over_sigma ** 2
-    recommended_factor = [
-        (target_i / scaled_debye_waller(target_d, *fit))
-        for target_d in desired_d_star_sq
-    ]
+    recommended_factor = list(target_i / scaled_debye_waller(desired_d_star_sq, *fit))
 
     # Get the achievable resolution at the current exposure
     desired_d += [np.sqrt(fit[0] / (2 * np.log(fit[1] / target_i)))]
@@ -449,30 +463,33 @@ def run(phil=phil_scope, args=None, set_up_logging=False):
         print(version_information)
         return
 
+    experiments = params.input.experiments[0]
+    reflections = params.input.reflections[0]
+
     if len(params.input.experiments) > 1:
         warn(
             "You provided more than one experiment list (%s).  Only the "
             "first, %s, will be used.",
             ", ".join([expt.filename for expt in params.input.experiments]),
-            params.input.experiments[0].filename,
+            experiments.filename,
         )
     if len(params.input.reflections) > 1:
         warn(
             "You provided more than one reflection table (%s).  Only the "
             "first, %s, will be used.",
             ", ".join([refls.filename for refls in params.input.reflections]),
-            params.input.reflections[0].filename,
+            reflections.filename,
         )
 
-    expts = params.input.experiments[0].data
-    refls = params.input.reflections[0].data
+    expts = experiments.data
+    refls = reflections.data
 
     if len(expts) > 1:
         warn(
             "The experiment list you provided, %s, contains more than one "
             "experiment object (perhaps multiple indexing solutions).  Only "
             "the first will be used, all others will be ignored.",
-            params.input.experiments[0].filename,
+            experiments.filename,
         )
 
     suggest_minimum_exposure(expts, refls, params)
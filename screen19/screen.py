@@ -44,17 +44,20 @@ Examples:
 
 from __future__ import absolute_import, division, print_function
 
+import functools
 import json
 import logging
 import math
 import os
 import re
 import sys
+import threading
 import time
 import timeit
 from glob import glob
-from typing import Dict, List, Optional, Sequence, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
 import procrunner
 from six.moves.cPickle import PickleError
 
@@ -64,7 +67,6 @@ from libtbx.introspection import number_of_processors
 from libtbx.phil import scope
 
 import dials.command_line.integrate
-import dials.util.version
 from dials.algorithms.indexing import DialsIndexError
 from dials.algorithms.indexing.bravais_settings import (
     refined_settings_from_refined_triclinic,
@@ -118,6 +120,13 @@ phil_scope = iotbx.phil.parse(
         .help = "The chosen value will apply to all the DIALS utilities with a "
                 "multi-processing option.  If 'False' or 'Auto', all available "
                 "processors will be used."
+    run_concurrently = True
+        .type = bool
+        .caption = 'Run independent steps concurrently'
+        .help = "Some steps, such as creating the DIALS report, only read files "
+                "that have already been written, so they can run alongside later "
+                "steps.  Set this to False to run every step in turn, for example "
+                "to limit peak memory usage."
 
     minimum_exposure
         .caption = 'Options for screen19.minimum_exposure'
@@ -212,6 +221,15 @@ phil_scope = iotbx.phil.parse(
 
 procrunner_debug = False
 
+# Finding the DIALS version may involve querying git, so only do it once.
+_dials_version_string = version.dials_version()
+
+sqrt_pi = math.sqrt(math.pi)
+
+# The table of Bravais settings in the output of dials.refine_bravais_settings.
+# Match the rows lazily, line by line, to avoid excessive backtracking.
+bravais_table = re.compile(r"[-+]{3,}\n[^\n]*\n[-+|]{3,}\n(?:[^\n]*\n)*?[-+]{3,}")
+
 logger = logging.getLogger("dials.screen19")
 debug, info, warning = logger.debug, logger.info, logger.warning
 
@@ -246,6 +264,156 @@ def _run_integration(scope, experiments_file, reflections_file):
     return expts, refls
 
 
+class _StepError(RuntimeError):
+    """A step of the screening pipeline has failed and screening cannot continue."""
+
+
+class _BackgroundTask(threading.Thread):
+    """Run a function in a background thread and collect its result later."""
+
+    def __init__(self, function, *args, **kwargs):
+        # type: (Callable, *Any, **Any) -> None
+        """
+        Start running the function in a new thread.
+
+        Args:
+            function:  The function to run.
+            *args:  Positional arguments for the function.
+            **kwargs:  Keyword arguments for the function.
+        """
+        super(_BackgroundTask, self).__init__()
+        self._task = functools.partial(function, *args, **kwargs)
+        self._result = None
+        self._exception = None  # type: Optional[BaseException]
+        self.start()
+
+    def run(self):  # type: () -> None
+        try:
+            self._result = self._task()
+        except BaseException as e:
+            self._exception = e
+
+    def result(self):  # type: () -> Any
+        """
+        Wait for the function to finish.
+
+        Returns:
+            The return value of the function.  If the function raised an exception,
+            that exception is re-raised here instead.
+        """
+        self.join()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+def _image_files(directory):  # type: (str) -> List[str]
+    """
+    List the CBF image files, including compressed files, in a directory.
+
+    Args:
+        directory:  Path to the directory.
+
+    Returns:
+        Paths of the image files.
+    """
+    extensions = (".cbf", ".cbf.gz", ".cbf.bz2")
+    try:
+        entries = os.scandir(directory)
+    except AttributeError:
+        # Python 2 has no os.scandir.
+        return [
+            os.path.join(directory, f)
+            for f in os.listdir(directory)
+            if f.endswith(extensions)
+        ]
+    with entries:
+        return [
+            entry.path
+            for entry in entries
+            if entry.name.endswith(extensions) and entry.is_file()
+        ]
+
+
+def _average_to_peak(oscillation, sigma_m):  # type: (float, float) -> float
+    u"""
+    Estimate the ratio of average to peak reflection intensity on a single image.
+
+    The reflection rocking curve is assumed to be Gaussian, with standard deviation
+    equal to the mosaicity, σ_m.
+
+    Args:
+        oscillation:  The oscillation width of each image.
+        sigma_m:  The mosaicity, in the same units as `oscillation`.
+
+    Returns:
+        The average-to-peak intensity ratio.
+    """
+    delta_z = oscillation / sigma_m / math.sqrt(2)
+    if delta_z < 1e-2:
+        # The closed form below suffers badly from cancellation error for small
+        # delta_z, so use its series expansion instead.
+        return 1 - delta_z ** 2 / 6 + delta_z ** 4 / 30
+    return (
+        sqrt_pi * delta_z * math.erf(delta_z) + math.exp(-(delta_z ** 2)) - 1
+    ) / delta_z ** 2
+
+
+def _pixel_count_histogram(overload_data):
+    # type: (Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]
+    """
+    Get the histogram of pixel intensities from the output of xia2.overload.
+
+    Args:
+        overload_data:  The contents of the overload.json file written by
+                        xia2.overload.  The histogram is either a list of 'bins',
+                        indexed by pixel count value, or a dictionary of 'counts'.
+
+    Returns:
+        The pixel count values, in ascending order, and the number of pixels
+        recording each value.  Only positive pixel count values, recorded by at
+        least one pixel, are included.
+    """
+    if "bins" in overload_data:
+        # The bins are indexed by pixel count value.
+        n_pixels = np.asarray(
+            overload_data["bins"][: overload_data["bin_count"]], dtype=np.int64
+        )
+        pixel_counts = np.arange(n_pixels.size)
+    else:
+        counts = overload_data["counts"]
+        pixel_counts = np.fromiter(
+            (int(k) for k in counts.keys()), dtype=np.int64, count=len(counts)
+        )
+        n_pixels = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+        order = np.argsort(pixel_counts)
+        pixel_counts, n_pixels = pixel_counts[order], n_pixels[order]
+
+    recorded = (pixel_counts > 0) & (n_pixels > 0)
+    return pixel_counts[recorded], n_pixels[recorded]
+
+
+def _rescale_histogram(pixel_counts, n_pixels, scale):
+    # type: (np.ndarray, np.ndarray, float) -> Dict[int, int]
+    """
+    Re-bin a histogram of pixel intensities on a rescaled intensity axis.
+
+    Args:
+        pixel_counts:  The pixel count values.
+        n_pixels:  The number of pixels recording each pixel count value.
+        scale:  The factor by which to multiply the pixel count values.  Each
+                rescaled value is rounded to the nearest integer bin.
+
+    Returns:
+        The number of pixels in each non-empty rescaled bin, indexed by bin.  Bins
+        at or below zero are omitted.
+    """
+    rescaled = np.rint(pixel_counts * scale).astype(np.int64)
+    positive = rescaled > 0
+    rescaled_hist = np.bincount(rescaled[positive], weights=n_pixels[positive])
+    return {int(k): int(rescaled_hist[k]) for k in np.flatnonzero(rescaled_hist)}
+
+
 def overloads_histogram(d_spacings, ticks=None, output="overloads"):
     # type: (Sequence[float], Optional[Sequence[float]], Optional[str]) -> None
     """
@@ -265,7 +433,7 @@ def overloads_histogram(d_spacings, ticks=None, output="overloads"):
     plt.xlabel(u"d (Å) (inverse scale)")
     plt.ylabel(u"Number of overloaded reflections")
     if ticks:
-        plt.xticks([1 / d for d in ticks], ["%g" % d for d in ticks])
+        plt.xticks(1 / np.asarray(ticks), ["%g" % d for d in ticks])
     plt.yscale("log", nonposy="clip")
     plt.hist(d_spacings, min(100, d_spacings.size()))
     plt.savefig(output)
@@ -311,23 +479,22 @@ class Screen19(object):
             return False
         debug("Attempting quick import...")
         files.sort()
-        templates = {}  # type: Dict[str, List[Optional[List[int]]]]
+        images = {}  # type: Dict[str, List[Optional[int]]]
         for f in files:
             template, image = screen19.make_template(f)
-            if template not in templates:
-                image_range = [image, image] if image else []
-                templates.update({template: [image_range]})
-            elif image == templates[template][-1][-1] + 1:
-                templates[template][-1][-1] = image
-            elif image == templates[template][-1][-1]:
-                # We have a duplicate input file name.  Do nothing.
-                pass
-            else:
-                templates[template].append([image, image])
-        # Return tuple of template and image range for each unique image range
-        templates = [
-            (t, tuple(r)) for t, ranges in templates.items() for r in ranges
-        ]  # type: Templates
+            images.setdefault(template, []).append(image)
+
+        # Get a tuple of template and image range for each unique image range
+        templates = []  # type: Templates
+        for template, numbers in images.items():
+            if None in numbers:
+                # No image number could be found in the file name.
+                templates.append((template, ()))
+                continue
+            # Discard duplicate file names and split into runs of consecutive images.
+            numbers = np.unique(numbers)
+            runs = np.split(numbers, np.flatnonzero(np.diff(numbers) != 1) + 1)
+            templates.extend((template, (int(r[0]), int(r[-1]))) for r in runs)
         return self._quick_import_templates(templates)
 
     def _quick_import_templates(self, templates):  # type: (Templates) -> bool
@@ -385,13 +552,7 @@ class Screen19(object):
                     "that directory."
                 )
                 # TODO Support HDF5.
-                files = [
-                    os.path.join(files[0], f)
-                    for f in os.listdir(files[0])
-                    if f.endswith(".cbf")
-                    or f.endswith(".cbf.gz")
-                    or f.endswith(".cbf.bz2")
-                ]
+                files = _image_files(files[0])
             elif len(files[0].split(":")) == 3:
                 debug(
                     "You specified an image range in the xia2 format.  "
@@ -402,10 +563,10 @@ class Screen19(object):
                 start, end = int(start), int(end)
                 if not self._quick_import_templates([(template, (start, end))]):
                     warning("Could not import specified image range.")
-                    sys.exit(1)
+                    raise _StepError
                 info("Quick import successful.")
                 return
-            elif files[0].endswith(".expt"):
+            elif files[0].endswith((".expt", ".json")):
                 debug(
                     "You specified an existing experiment list file.  "
                     "No import necessary."
@@ -421,7 +582,7 @@ class Screen19(object):
 
         if not files:
             warning("No images found matching input.")
-            sys.exit(1)
+            raise _StepError
 
         # Can the files be quick-imported?
         if self._quick_import(files):
@@ -488,14 +649,14 @@ class Screen19(object):
                 )
             except IOError as e:
                 warning("%s '%s'", e.strerror, e.filename)
-                sys.exit(1)
+                raise _StepError
 
             # Record the imported experiments for use elsewhere.
             # Quit if there aren't any.
             self.expts.extend(experiments)
             if not self.expts:
                 warning("No images found.")
-                sys.exit(1)
+                raise _StepError
 
         else:
             # Use the template importer.
@@ -511,7 +672,7 @@ class Screen19(object):
                         "No images found matching template %s"
                         % self.params.dials_import.input.template[0]
                     )
-                    sys.exit(1)
+                    raise _StepError
 
         # Setup the metadata updater
         metadata_updater = MetaDataUpdater(self.params.dials_import)
@@ -524,7 +685,9 @@ class Screen19(object):
         Determine the number of processors and save it as an instance variable.
 
         The user may specify the number of processors to use.  If no value is
-        given, the number of available processors is returned.
+        given, the number of available processors is returned.  Any limit set by
+        the NSLOTS environment variable or by the CPU affinity of the process is
+        respected.
 
         Args:
             nproc (optional):  Number of processors.
@@ -540,6 +703,15 @@ class Screen19(object):
         except (ValueError, TypeError):
             pass
 
+        # Respect any CPU affinity restriction, such as from a batch scheduler or
+        # cgroup, rather than counting every processor on the machine.
+        try:
+            self.nproc = len(os.sched_getaffinity(0))
+            return
+        except (AttributeError, OSError):
+            # os.sched_getaffinity is only available on some platforms.
+            pass
+
         self.nproc = number_of_processors(return_value_if_unknown=-1)
 
         if self.nproc <= 0:
@@ -547,7 +719,7 @@ class Screen19(object):
                 "Could not determine number of available processors. Error code %d",
                 self.nproc,
             )
-            sys.exit(1)
+            raise _StepError
 
     def _count_images(self):  # type: () -> int
         """
@@ -565,7 +737,7 @@ class Screen19(object):
             return self.expts[0].imageset.size()
         except IndexError:
             warning("Could not determine number of images in dataset.")
-            sys.exit(1)
+            raise _StepError
 
     def _check_intensities(self, mosaicity_correction=True):  # type: (bool) -> None
         """
@@ -582,69 +754,55 @@ class Screen19(object):
         command = ["xia2.overload", "nproc=%s" % self.nproc, "indexed.expt"]
         debug("running %s", command)
         result = procrunner.run(command, print_stdout=False, debug=procrunner_debug)
-        debug("result = %s", screen19.prettyprint_dictionary(result))
+        screen19.debug_result(result)
         info("Successfully completed (%.1f sec)", result["runtime"])
 
         if result["exitcode"] != 0:
             warning("Failed with exit code %d", result["exitcode"])
-            sys.exit(1)
+            raise _StepError
 
         with open("overload.json") as fh:
             overload_data = json.load(fh)
 
         info("Pixel intensity distribution:")
-        count_sum = 0
-        hist = {}
-        if "bins" in overload_data:
-            for b in range(overload_data["bin_count"]):
-                if overload_data["bins"][b] > 0:
-                    hist[b] = overload_data["bins"][b]
-                    count_sum += b * overload_data["bins"][b]
-        else:
-            hist = {int(k): v for k, v in overload_data["counts"].items() if int(k) > 0}
-            count_sum = sum([k * v for k, v in hist.items()])
+        pixel_counts, n_pixels = _pixel_count_histogram(overload_data)
+        count_sum = int(np.dot(pixel_counts, n_pixels))
 
         average_to_peak = 1
         if mosaicity_correction:
             # Adjust for the detector count rate correction
             if self._sigma_m:
-                delta_z = self._oscillation / self._sigma_m / math.sqrt(2)
-                average_to_peak = (
-                    math.sqrt(math.pi) * delta_z * math.erf(delta_z)
-                    + math.exp(-(delta_z ** 2))
-                    - 1
-                ) / delta_z ** 2
+                average_to_peak = _average_to_peak(self._oscillation, self._sigma_m)
                 info("Average-to-peak intensity ratio: %f", average_to_peak)
 
         scale = 100 * overload_data["scale_factor"] / average_to_peak
         info("Determined scale factor for intensities as %f", scale)
 
-        debug(
-            "intensity histogram: { %s }",
-            ", ".join(["%d:%d" % (k, hist[k]) for k in sorted(hist)]),
-        )
-        max_count = max(hist.keys())
+        # Only format the (potentially very long) histograms if they will be logged.
+        log_histograms = logger.isEnabledFor(logging.DEBUG)
+        if log_histograms:
+            debug(
+                "intensity histogram: { %s }",
+                ", ".join("%d:%d" % (k, v) for k, v in zip(pixel_counts, n_pixels)),
+            )
+        max_count = int(pixel_counts.max())
         hist_max = max_count * scale
         hist_granularity, hist_format = 1, "%.0f"
         if hist_max < 50:
             hist_granularity, hist_format = 2, "%.1f"
         if hist_max < 15:
             hist_granularity, hist_format = 10, "%.1f"
-        rescaled_hist = {}
-        for x in hist.keys():
-            rescaled = round(x * scale * hist_granularity)
-            if rescaled > 0:
-                rescaled_hist[rescaled] = hist[x] + rescaled_hist.get(rescaled, 0)
-        hist = rescaled_hist
-        debug(
-            "rescaled histogram: { %s }",
-            ", ".join(
-                [
-                    (hist_format + ":%d") % (k / hist_granularity, hist[k])
-                    for k in sorted(hist)
-                ]
-            ),
-        )
+        hist = _rescale_histogram(pixel_counts, n_pixels, scale * hist_granularity)
+        if log_histograms:
+            debug(
+                "rescaled histogram: { %s }",
+                ", ".join(
+                    [
+                        (hist_format + ":%d") % (k / hist_granularity, hist[k])
+                        for k in sorted(hist)
+                    ]
+                ),
+            )
 
         screen19.plot_intensities(
             hist, 1 / hist_granularity, procrunner_debug=procrunner_debug
@@ -809,9 +967,9 @@ class Screen19(object):
         symb = sg_type.universal_hermann_mauguin_symbol()
         unit_cell = self.expts[0].crystal.get_unit_cell()
 
-        self.refls.as_file(self.params.dials_index.output.reflections)
-        self.expts.as_file(self.params.dials_index.output.experiments)
-        self.refls.as_file(self.params.dials_index.output.reflections)
+        output = self.params.dials_index.output
+        self.expts.as_file(output.experiments)
+        self.refls.as_file(output.reflections)
         info(
             "Found primitive solution: %s %s using %s reflections\n"
             "Indexed experiments and reflections saved as %s, %s\n"
@@ -819,8 +977,8 @@ class Screen19(object):
             symb,
             unit_cell,
             self.refls["id"].count(0),
-            self.params.dials_index.output.experiments,
-            self.params.dials_index.output.reflections,
+            output.experiments,
+            output.reflections,
             timeit.default_timer() - dials_start,
         )
 
@@ -855,7 +1013,7 @@ class Screen19(object):
             )
         except Sorry as e:
             warning("dials.refine failed: %d\nGiving up.\n", e)
-            sys.exit(1)
+            raise _StepError
 
         info("Successfully refined (%.1f sec)", timeit.default_timer() - dials_start)
 
@@ -871,17 +1029,18 @@ class Screen19(object):
             model from the data.
         """
         info("\nCreating profile model...")
+        indexed = self.params.dials_index.output
         command = [
             "dials.create_profile_model",
-            self.params.dials_index.output.experiments,
-            self.params.dials_index.output.reflections,
-            "output = %s" % self.params.dials_index.output.experiments,
+            indexed.experiments,
+            indexed.reflections,
+            "output = %s" % indexed.experiments,
         ]
         result = procrunner.run(command, print_stdout=False, debug=procrunner_debug)
-        debug("result = %s", screen19.prettyprint_dictionary(result))
+        screen19.debug_result(result)
         self._sigma_m = None
         if result["exitcode"] == 0:
-            db = ExperimentList.from_file(self.params.dials_index.output.experiments)[0]
+            db = ExperimentList.from_file(indexed.experiments)[0]
             self._oscillation = db.imageset.get_scan().get_oscillation()[1]
             self._sigma_m = db.profile.sigma_m()
             info(
@@ -902,24 +1061,22 @@ class Screen19(object):
 
         # Don't waste time recreating the profile model
         self.params.dials_integrate.create_profile_model = False
-        # Get the dials.integrate PHIL scope, populated with parsed input parameters
-        integrate_scope = phil_scope.get("dials_integrate").objects[0]
-        integrate_scope.name = ""
-        integrate_scope = integrate_scope.format(self.params.dials_integrate)
+        # Get the dials.integrate PHIL scope, populated with parsed input parameters.
+        # Format them with the master scope that dials.integrate has already parsed,
+        # rather than extracting and renaming a copy of our own included scope.
+        integrate_scope = dials.command_line.integrate.phil_scope.format(
+            self.params.dials_integrate
+        )
 
+        indexed = self.params.dials_index.output
+        output = self.params.dials_integrate.output
         try:
             integrated_experiments, integrated_reflections = _run_integration(
-                integrate_scope,
-                self.params.dials_index.output.experiments,
-                self.params.dials_index.output.reflections,
+                integrate_scope, indexed.experiments, indexed.reflections
             )
             # Save the output to files
-            integrated_reflections.as_file(
-                self.params.dials_integrate.output.reflections
-            )
-            integrated_experiments.as_file(
-                self.params.dials_integrate.output.experiments
-            )
+            integrated_reflections.as_file(output.reflections)
+            integrated_experiments.as_file(output.experiments)
             # ... and also store the output internally
             self.expts, self.refls = integrated_experiments, integrated_reflections
             info(
@@ -929,10 +1086,10 @@ class Screen19(object):
         except SystemExit as e:
             if e.code:
                 warning("dials.integrate failed with exit code %d\nGiving up.", e.code)
-                sys.exit(1)
+                raise _StepError
 
     # This is a hacky check but should work for as long as DIALS 2.0 is supported.
-    if version.dials_version() < "DIALS 2.1":
+    if _dials_version_string < "DIALS 2.1":
 
         def _refine_bravais(self, experiments, reflections):
             # type: (ExperimentList, flex.reflection_table) -> None
@@ -946,12 +1103,9 @@ class Screen19(object):
             info("\nRefining Bravais settings...")
             command = ["dials.refine_bravais_settings", experiments, reflections]
             result = procrunner.run(command, print_stdout=False, debug=procrunner_debug)
-            debug("result = %s", screen19.prettyprint_dictionary(result))
+            screen19.debug_result(result)
             if result["exitcode"] == 0:
-                m = re.search(
-                    r"[-+]{3,}\n[^\n]*\n[-+|]{3,}\n(.*\n)*[-+]{3,}",
-                    result["stdout"].decode("utf-8"),
-                )
+                m = bravais_table.search(result["stdout"].decode("utf-8"))
                 if m:
                     info(m.group(0))
                 else:
@@ -962,7 +1116,7 @@ class Screen19(object):
                 info("Successfully completed (%.1f sec)", result["runtime"])
             else:
                 warning("Failed with exit code %d", result["exitcode"])
-                sys.exit(1)
+                raise _StepError
 
     else:
 
@@ -979,8 +1133,8 @@ class Screen19(object):
                     self.expts, self.refls, self.params.dials_refine_bravais
                 )
             except RuntimeError as e:
-                warning("dials.refine_bravais_settings failed.\nGiving up.")
-                sys.exit(e)
+                warning("dials.refine_bravais_settings failed: %s\nGiving up.", e)
+                raise _StepError
 
             possible_bravais_settings = {
                 solution["bravais"] for solution in refined_settings
@@ -998,83 +1152,66 @@ class Screen19(object):
                 timeit.default_timer() - dials_start,
             )
 
-    def _report(self, experiments, reflections):
-        # type: (ExperimentList, flex.reflection_table) -> None
+    def _report(self, experiments, reflections, background=False):
+        # type: (str, str, bool) -> Optional[Callable[[], None]]
         """
         Run `dials.report` on an experiment list and reflection table.
 
-        Args:
-            experiments:  An experiment list.
-            reflections:  The corresponding reflection table.
-        """
-        info("\nCreating report...")
-        command = ["dials.report", experiments, reflections]
-        result = procrunner.run(command, print_stdout=False, debug=procrunner_debug)
-        debug("result = %s", screen19.prettyprint_dictionary(result))
-        if result["exitcode"] == 0:
-            info("Successfully completed (%.1f sec)", result["runtime"])
-        #     if sys.stdout.isatty():
-        #       info("Trying to start browser")
-        #       try:
-        #         import subprocess
-        #         d = dict(os.environ)
-        #         d["LD_LIBRARY_PATH"] = ""
-        #         subprocess.Popen(["xdg-open", "dials-report.html"], env=d)
-        #       except Exception as e:
-        #         debug("Could not open browser\n%s", str(e))
-        else:
-            warning("Failed with exit code %d", result["exitcode"])
-            sys.exit(1)
-
-    def run(self, args=None, phil=phil_scope, set_up_logging=False):
-        # type: (Optional[List[str]], scope, bool) -> None
-        """
-        TODO: Docstring.
+        dials.report only reads the files it is given, so it can be left to run in
+        the background while screening continues.
 
         Args:
-            args:
-            phil:
-            set_up_logging:
+            experiments:  An experiment list file.
+            reflections:  The corresponding reflection table file.
+            background (optional):  If true, return as soon as dials.report has
+                                    started, with a function that waits for it to
+                                    finish and reports the outcome.  Default is
+                                    `False`.
 
         Returns:
-
+            If `background` is true, the function to wait for dials.report.
         """
-        usage = "%prog [options] image_directory | image_files.cbf | imported.expt"
-
-        parser = OptionParser(
-            usage=usage, epilog=__doc__, phil=phil, check_format=False
-        )
-
-        self.params, options, unhandled = parser.parse_args(
-            args=args, show_diff_phil=True, return_unhandled=True, quick_parse=True
-        )
-
-        version_information = "screen19 v%s using %s (%s)" % (
-            screen19.__version__,
-            dials.util.version.dials_version(),
-            time.strftime("%Y-%m-%d %H:%M:%S"),
+        command = ["dials.report", experiments, reflections]
+        run_report = functools.partial(
+            procrunner.run, command, print_stdout=False, debug=procrunner_debug
         )
 
-        start = timeit.default_timer()
+        def finish(get_result):  # type: (Callable[[], Dict[str, Any]]) -> None
+            info("\nCreating report...")
+            result = get_result()
+            screen19.debug_result(result)
+            if result["exitcode"] == 0:
+                info("Successfully completed (%.1f sec)", result["runtime"])
+            #     if sys.stdout.isatty():
+            #       info("Trying to start browser")
+            #       try:
+            #         import subprocess
+            #         d = dict(os.environ)
+            #         d["LD_LIBRARY_PATH"] = ""
+            #         subprocess.Popen(["xdg-open", "dials-report.html"], env=d)
+            #       except Exception as e:
+            #         debug("Could not open browser\n%s", str(e))
+            else:
+                warning("Failed with exit code %d", result["exitcode"])
+                raise _StepError
 
-        if len(unhandled) == 0:
-            print(__doc__)
-            print(version_information)
-            return
+        if background:
+            return functools.partial(finish, _BackgroundTask(run_report).result)
+        finish(run_report)
 
-        if set_up_logging:
-            # Configure the logging
-            log.config(verbosity=self.params.verbosity, logfile=self.params.output.log)
-            # Unless verbose output has been requested, suppress generation of
-            # debug and info log records from any child DIALS command, retaining
-            # those from screen19 itself.
-            if not self.params.verbosity:
-                logging.getLogger("dials").setLevel(logging.WARNING)
-                logging.getLogger("dials.screen19").setLevel(logging.INFO)
+    def _run_pipeline(self, files, start):  # type: (List[str], float) -> None
+        """
+        Run each step of the screening pipeline in turn.
 
-        info(version_information)
-        debug("Run with:\n%s\n%s", " ".join(unhandled), parser.diff_phil.as_str())
+        Args:
+            files:  The input image files or experiment list, as given on the
+                    command line.
+            start:  The start time of the screening run, from timeit.default_timer.
 
+        Raises:
+            _StepError:  If a step fails in a way that prevents screening from
+                         continuing.
+        """
         self._count_processors(nproc=self.params.nproc)
         debug("Using %s processors", self.nproc)
         # Set multiprocessing settings for spot-finding, indexing and
@@ -1087,7 +1224,7 @@ class Screen19(object):
         # Set the input and output parameters for the DIALS components
         # TODO: Compare to diff_phil and start from later in the pipeline if
         #  appropriate
-        self._import(unhandled)
+        self._import(files)
         imported_name = self.params.dials_import.output.experiments
 
         self._find_spots()
@@ -1116,7 +1253,7 @@ class Screen19(object):
                     imported_name,
                     "stronger.refl",
                 )
-                sys.exit(1)
+                raise _StepError
 
         if not self._create_profile_model():
             info("\nRefining model to attempt to increase number of valid spots...")
@@ -1129,30 +1266,42 @@ class Screen19(object):
                     "running:\n\n"
                     "    dials.reciprocal_lattice_viewer indexed.expt indexed.refl\n"
                 )
-                sys.exit(1)
+                raise _StepError
 
         self._check_intensities()
 
         if self.params.minimum_exposure.data == "integrated":
             self._integrate()
 
-            self._wilson_calculation()
-
-            experiments = self.params.dials_integrate.output.experiments
-            reflections = self.params.dials_integrate.output.reflections
+            output = self.params.dials_integrate.output
+            experiments, reflections = output.experiments, output.reflections
         else:
-            self._wilson_calculation()
-
             experiments = self.params.dials_create_profile.output
             reflections = self.params.dials_index.output.reflections
 
+        finish_report = None
+        if self.params.run_concurrently:
+            # dials.report only reads the output files, so run it alongside the
+            # Wilson plot calculation.
+            finish_report = self._report(experiments, reflections, background=True)
+
+        try:
+            self._wilson_calculation()
+        finally:
+            # Don't leave dials.report running unnoticed, even if the Wilson plot
+            # calculation fails.  Bravais setting refinement may start worker
+            # processes of its own, so the report must also finish before it starts.
+            if finish_report:
+                finish_report()
+
         # This is a hacky check but should work for as long as DIALS 2.0 is supported.
-        if version.dials_version() < "DIALS 2.1":
+        if _dials_version_string < "DIALS 2.1":
             self._refine_bravais(experiments, reflections)
         else:
             self._refine_bravais()
 
-        self._report(experiments, reflections)
+        if not finish_report:
+            self._report(experiments, reflections)
 
         runtime = timeit.default_timer() - start
         debug(
@@ -1162,7 +1311,66 @@ class Screen19(object):
         )
         info("screen19 successfully completed (%.1f sec).", runtime)
 
+    def run(self, args=None, phil=phil_scope, set_up_logging=False):
+        # type: (Optional[List[str]], scope, bool) -> Optional[int]
+        """
+        Parse the command-line arguments and run the screening pipeline.
+
+        With no input files, print the help message and version information instead.
+
+        Args:
+            args:  Arguments to parse.  If None, `sys.argv[1:]` will be used.
+            phil:  The PHIL scope for the option parser.
+            set_up_logging:  Choose whether to configure `screen19` logging.
+
+        Returns:
+            A non-zero exit code if screening failed, otherwise None.  Failure
+            is reported to the caller, rather than by exiting, so that screen19
+            can be run repeatedly from within a single Python session.
+        """
+        usage = "%prog [options] image_directory | image_files.cbf | imported.expt"
+
+        parser = OptionParser(
+            usage=usage, epilog=__doc__, phil=phil, check_format=False
+        )
+
+        self.params, options, unhandled = parser.parse_args(
+            args=args, show_diff_phil=True, return_unhandled=True, quick_parse=True
+        )
+
+        version_information = "screen19 v%s using %s (%s)" % (
+            screen19.__version__,
+            _dials_version_string,
+            time.strftime("%Y-%m-%d %H:%M:%S"),
+        )
+
+        start = timeit.default_timer()
+
+        if len(unhandled) == 0:
+            print(__doc__)
+            print(version_information)
+            return
+
+        if set_up_logging:
+            # Configure the logging
+            log.config(verbosity=self.params.verbosity, logfile=self.params.output.log)
+            # Unless verbose output has been requested, suppress generation of
+            # debug and info log records from any child DIALS command, retaining
+            # those from screen19 itself.
+            if not self.params.verbosity:
+                logging.getLogger("dials").setLevel(logging.WARNING)
+                logging.getLogger("dials.screen19").setLevel(logging.INFO)
+
+        info(version_information)
+        if logger.isEnabledFor(logging.DEBUG):
+            debug("Run with:\n%s\n%s", " ".join(unhandled), parser.diff_phil.as_str())
+
+        try:
+            self._run_pipeline(unhandled, start)
+        except _StepError:
+            return 1
+
 
 def main():  # type: () -> None
     """Dispatcher for command-line call."""
-    Screen19().run(set_up_logging=True)
+    sys.exit(Screen19().run(set_up_logging=True))
@@ -2,10 +2,17 @@
 
 from __future__ import absolute_import, division, print_function
 
+import math
+
 import pytest
 
 from screen19 import minimum_exposure
-from screen19.screen import Screen19
+from screen19.screen import (
+    Screen19,
+    _average_to_peak,
+    _pixel_count_histogram,
+    _rescale_histogram,
+)
 
 # A list of tuples of example sys.argv[1:] cases and associated image count.
 import_checks = [
@@ -28,6 +35,59 @@ import_checks = [
 ]
 
 
+def test_average_to_peak_small_oscillation():
+    """Check the series expansion used for small oscillation widths."""
+
+    def closed_form(delta_z):
+        return (
+            math.sqrt(math.pi) * delta_z * math.erf(delta_z)
+            + math.exp(-(delta_z ** 2))
+            - 1
+        ) / delta_z ** 2
+
+    # The series expansion is used below delta_z = 1e-2, the closed form above it.
+    threshold = 1e-2 * math.sqrt(2)
+    below = _average_to_peak(threshold * (1 - 1e-9), 1)
+    above = _average_to_peak(threshold, 1)
+    assert above == pytest.approx(closed_form(1e-2), rel=1e-12)
+    assert below == pytest.approx(above, rel=1e-9)
+
+    # As the oscillation becomes small compared to the mosaicity, the average
+    # intensity on an image approaches the peak intensity.
+    ratios = [_average_to_peak(oscillation, 1) for oscillation in (1e-3, 1e-6, 1e-9)]
+    assert ratios == sorted(ratios)
+    assert all(ratio < 1 for ratio in ratios[:-1])
+    assert ratios[-1] == pytest.approx(1, abs=1e-15)
+
+
+@pytest.mark.parametrize(
+    "overload_data",
+    [
+        # xia2.overload output with a list of bins, indexed by pixel count.
+        {"bin_count": 12, "bins": [7, 0, 3, 0, 2, 0, 0, 0, 0, 0, 1, 0, 0, 5]},
+        # xia2.overload output with a dictionary of pixel counts.
+        {"counts": {"10": 1, "0": 7, "4": 2, "2": 3, "7": 0, "-1": 4}},
+    ],
+)
+def test_pixel_intensity_histogram(overload_data):
+    """Check the histogram of pixel intensities from both xia2.overload formats."""
+    pixel_counts, n_pixels = _pixel_count_histogram(overload_data)
+
+    # Only positive pixel counts recorded by at least one pixel are kept, in order.
+    assert pixel_counts.tolist() == [2, 4, 10]
+    assert n_pixels.tolist() == [3, 2, 1]
+
+    count_sum = int(pixel_counts.dot(n_pixels))
+    max_count = int(pixel_counts.max())
+    assert count_sum == 2 * 3 + 4 * 2 + 10 * 1
+    assert max_count == 10
+
+    # Pixel counts 2 and 4 share a rescaled bin, 0.6 and 1.2 both rounding to 1.
+    assert _rescale_histogram(pixel_counts, n_pixels, 0.3) == {1: 5, 3: 1}
+    # Bins that round down to zero are dropped.
+    assert _rescale_histogram(pixel_counts, n_pixels, 0.2) == {1: 2, 2: 1}
+
+
 def test_screen19_command_line_help_does_not_crash():
     Screen19().run([])
 
@@ -91,3 +151,11 @@ def test_screen19_single_frame(dials_data, tmpdir):
     logfile = tmpdir.join("screen19.log").read()
 
     assert "screen19 successfully completed" in logfile
+
+
+def test_screen19_failure_returns_exit_code(tmpdir):
+    """A failed screening run is reported by the return value, without exiting."""
+    empty = tmpdir.mkdir("empty")
+
+    with tmpdir.as_cwd():
+        assert Screen19().run([empty.strpath]) == 1